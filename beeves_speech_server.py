@@ -1,46 +1,57 @@
 #!/usr/bin/env python3
 
 import argparse
-import glob
+import ctypes
 import json
 import logging
+import math
 import os
 import platform
+import queue
 import struct
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from threading import Thread
+from functools import cached_property, lru_cache
+from threading import Event, Lock, Thread
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'Porcupine/binding/python'))
 
 from porcupine import Porcupine  # noqa
 
-logging.basicConfig(level=logging.DEBUG)
+# INFO unless overridden, e.g. BEEVES_LOG_LEVEL=DEBUG; logs go to stderr, stdout carries native messages.
+logging.basicConfig(level=os.environ.get('BEEVES_LOG_LEVEL', 'INFO').upper())
 
+# Native-messaging length prefix, compiled once rather than per message.
+_MESSAGE_LENGTH = struct.Struct('@I')
 
-def encodeMessage(messageContent):
-    encodedContent = json.dumps(messageContent).encode('utf-8')
-    encodedLength = struct.pack('@I', len(encodedContent))
-    return {'length': encodedLength, 'content': encodedContent}
+# Closes the JSON object of a detection message after its timestamp; see HotwordServer._detection_prefixes.
+_DETECTION_SUFFIX = b'"}'
 
 
-# Send an encoded message to stdout
+# Frame already-encoded JSON with its native-messaging length prefix
+def frameMessage(encodedContent):
+    return _MESSAGE_LENGTH.pack(len(encodedContent)) + encodedContent
+
+
+# Send an encoded message to stdout as a single write, so the frame reaches the pipe in one piece
 def sendMessage(encodedMessage):
-    sys.stdout.buffer.write(encodedMessage['length'])
-    sys.stdout.buffer.write(encodedMessage['content'])
-    sys.stdout.buffer.flush()
+    stdout = sys.stdout.buffer
+    stdout.write(encodedMessage)
+    stdout.flush()
 
 
-def get_keywords_directory(base_dir='./Porcupine/resources/keyword_files'):
-    system = platform.system()
+_KEYWORD_DIR_MAPPINGS = {
+    'Darwin' : 'mac',
+    'Linux'  : 'linux',
+    'Windows': 'windows'
+}
 
-    dir_mappings = {
-        'Darwin' : 'mac',
-        'Linux'  : 'linux',
-        'Windows': 'windows'
-    }
 
-    return os.path.join(base_dir, dir_mappings[system])
+@lru_cache(maxsize=None)
+def get_keywords_directory(base_dir='./Porcupine/resources/keyword_files'):
+    return os.path.join(base_dir, _KEYWORD_DIR_MAPPINGS[platform.system()])
 
 
 def int_or_str(text):
@@ -51,11 +62,355 @@ def int_or_str(text):
         return text
 
 
+# PortAudio's Unix host APIs otherwise clamp the suggested latency to a conservative default; must be set before
+# PortAudio is initialised.
+os.environ.setdefault('PA_MIN_LATENCY_MSEC', '5')
+
 import sounddevice as sd
 import numpy  # Make sure NumPy is loaded before it is used in the callback
 
 assert numpy  # avoid "imported but unused" message (W0611)
 
+try:
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+    logging.warning('numba is not installed: DC blocking is disabled and the --silence_gate energy kernel runs as '
+                    'plain Python')
+
+    def njit(*args, **kwargs):
+        """Stand-in for ``numba.njit`` when Numba is not installed: the kernels run as plain Python."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Porcupine frames delivered per PortAudio callback. Larger blocks mean fewer callbacks and ALSA wakeups. The cost is
+# latency: a 4-frame block (~128 ms at 16 kHz) arrives all at once, so its first frame waits ~96 ms longer than with
+# 1-frame blocks, ~48 ms on average across the block.
+_BLOCK_FRAMES = 4
+
+# Capacity of the capture ring, and how far the detector may fall behind before stale audio is dropped, in audio
+# blocks. The gap between the two keeps the writer clear of the samples being read.
+_RING_BUFFER_BLOCKS = 4
+_MAX_BACKLOG_BLOCKS = 2
+
+# Largest aligned block, as a multiple of the unaligned one, before alignment is abandoned. Periods that share few
+# factors with the frame length (e.g. 441) would otherwise push the block to seconds of audio.
+_MAX_ALIGNED_BLOCK_FACTOR = 2
+
+# Minimum interval between log reports of dropped audio and input stream status flags.
+_AUDIO_REPORT_SECONDS = 10
+
+
+def aligned_blocksize(frame_length, period=None, minimum=0):
+    """
+    Smallest multiple of both Porcupine's frame length and the hardware period that is at least ``minimum`` samples.
+    Keeping the PortAudio block a whole number of periods spares its ALSA back-end an intermediate re-buffering copy,
+    and keeping it a whole number of frames means every block splits into frames without a remainder. If aligning to
+    the period would make the block more than ``_MAX_ALIGNED_BLOCK_FACTOR`` times the unaligned size, a warning is
+    logged and the period is ignored.
+
+    :param frame_length: Porcupine frame length in samples.
+    :param period: Hardware period in samples (commonly 256 or 1024 on ALSA), or None if unknown.
+    :param minimum: Lower bound on the block size in samples.
+    :return: Block size in samples.
+    """
+
+    unaligned = max(1, -(-minimum // frame_length)) * frame_length
+    if period is None:
+        return unaligned
+    if period <= 0:
+        raise ValueError('period must be a positive number of samples, got %d' % period)
+
+    step = frame_length * period // math.gcd(frame_length, period)
+    blocksize = max(1, -(-minimum // step)) * step
+    if blocksize > _MAX_ALIGNED_BLOCK_FACTOR * unaligned:
+        logging.warning('aligning to a %d-sample period needs %d-sample blocks; using unaligned %d-sample blocks',
+                        period, blocksize, unaligned)
+        return unaligned
+    return blocksize
+
+
+# Pole of the DC-blocking filter; puts the corner at ~20 Hz for 16 kHz audio.
+_DC_BLOCK_POLE = 0.992
+
+
+@njit(cache=True, fastmath=True)
+def dc_block(frame, state, pole):
+    """
+    In-place one-pole DC-blocking filter, y[n] = x[n] - x[n-1] + pole * y[n-1], over an int16 frame. Removes
+    microphone DC offset before detection without touching the speech band.
+
+    :param frame: 1-D int16 array, overwritten with the filtered samples.
+    :param state: float64 array of (x[n-1], y[n-1]) carried across frames.
+    :param pole: Filter pole in (0, 1); closer to 1 means a lower corner frequency.
+    """
+
+    x1 = state[0]
+    y1 = state[1]
+    for i in range(frame.shape[0]):
+        x = float(frame[i])
+        y = x - x1 + pole * y1
+        x1 = x
+        y1 = y
+        if y > 32767.0:
+            y = 32767.0
+        elif y < -32768.0:
+            y = -32768.0
+        frame[i] = y
+    state[0] = x1
+    state[1] = y1
+
+
+@njit(cache=True, fastmath=True)
+def frame_energy(frame):
+    """
+    Sum of squared samples of an int16 frame, widened so a full-scale 512-sample frame cannot overflow.
+
+    :param frame: 1-D int16 array.
+    :return: Frame energy.
+    """
+
+    energy = 0
+    for i in range(frame.shape[0]):
+        sample = int(frame[i])
+        energy += sample * sample
+    return energy
+
+
+# Silence gate tuning: how fast the noise floor tracks quiet and loud frames, how many frames stay open after the
+# last loud one so the tail of a wake word is not cut off, and how often a gated frame is still fed to Porcupine.
+_NOISE_FLOOR_DECAY = 0.05
+_NOISE_FLOOR_ATTACK = 0.001
+_GATE_HANGOVER_FRAMES = 16
+_GATE_REFRESH_FRAMES = 8
+_MIN_NOISE_FLOOR = 1.0
+
+
+class SilenceGate(object):
+    """
+    Energy gate that tells the detector loop when a frame is clearly silence so ``porcupine.process`` can be skipped.
+    A frame passes when its energy exceeds ``threshold`` times a running noise-floor estimate; after a loud frame the
+    gate stays open for a short hangover, and every few gated frames one is let through anyway so Porcupine's
+    internal state keeps tracking the background.
+    """
+
+    def __init__(self, threshold):
+        """
+        Constructor.
+
+        :param threshold: Multiple of the noise floor a frame's energy must exceed to be processed.
+        """
+
+        self._threshold = threshold
+        self._noise_floor = None
+        self._hangover = 0
+        self._gated = 0
+
+    def is_open(self, frame):
+        """
+        Updates the noise floor with ``frame`` and reports whether it should be passed to the detector.
+
+        :param frame: 1-D int16 array.
+        :return: True if the frame should be processed.
+        """
+
+        energy = frame_energy(frame)
+        if self._noise_floor is None:
+            # Devices often deliver zero-filled frames at startup. Seed the floor from the first frame with any signal,
+            # since a floor of 0 would call every later frame loud and then crawl up at the attack rate.
+            if not energy:
+                return True
+            self._noise_floor = energy
+
+        if energy > self._threshold * self._noise_floor:
+            self._noise_floor += _NOISE_FLOOR_ATTACK * (energy - self._noise_floor)
+            self._hangover = _GATE_HANGOVER_FRAMES
+            return True
+
+        # Clamped so a muted input cannot decay the floor to 0, which would make every frame count as loud again.
+        self._noise_floor = max(_MIN_NOISE_FLOOR, self._noise_floor + _NOISE_FLOOR_DECAY * (energy - self._noise_floor))
+        if self._hangover:
+            self._hangover -= 1
+            return True
+
+        self._gated += 1
+        return self._gated % _GATE_REFRESH_FRAMES == 0
+
+
+def make_frame_processor(porcupine, frame):
+    """
+    Returns a no-argument callable that runs ``porcupine`` on ``frame`` and reports whether its keyword was detected.
+    ``frame`` is a preallocated int16 array refilled in place between calls. When the binding exposes its ctypes
+    handle and its process function is declared to write an ``int`` keyword index (as the multiple-keywords API does,
+    -1 meaning no detection), that function is called with a pointer into ``frame`` computed once. This skips the
+    per-call copy of every sample into a fresh ``c_short`` array that ``Porcupine.process`` makes; any other binding
+    falls back to ``Porcupine.process``.
+
+    :param porcupine: Porcupine instance listening for a single keyword.
+    :param frame: Contiguous 1-D int16 array of ``porcupine.frame_length`` samples, kept alive by the caller.
+    :return: Callable returning True on detection.
+    """
+
+    process_func = getattr(porcupine, 'process_func', None)
+    handle = getattr(porcupine, '_handle', None)
+    statuses = getattr(porcupine, 'PicovoiceStatuses', None)
+    argtypes = getattr(process_func, 'argtypes', None)
+    if (handle is None or statuses is None or not argtypes or len(argtypes) != 3
+            or argtypes[2] != ctypes.POINTER(ctypes.c_int)):
+        return lambda: porcupine.process(frame)
+
+    pcm = frame.ctypes.data_as(ctypes.POINTER(ctypes.c_short))
+    keyword_index = ctypes.c_int()
+    keyword_index_ref = ctypes.byref(keyword_index)
+    success = statuses.SUCCESS
+
+    def process():
+        status = process_func(handle, pcm, keyword_index_ref)
+        if status is not success and status != success.value:
+            raise RuntimeError('porcupine processing failed with status %s' % status)
+        return keyword_index.value >= 0
+
+    return process
+
+
+# Linux <sys/mman.h> flags for mlockall().
+_MCL_CURRENT = 1
+_MCL_FUTURE = 2
+
+
+def make_current_thread_realtime(priority, cpus=None):
+    """
+    Best-effort promotion of the calling thread for low-latency detection: SCHED_FIFO at ``priority``, optional CPU
+    pinning, and on Linux locking the process's pages in memory so detection never takes a page fault. Each step needs
+    privileges (CAP_SYS_NICE / CAP_IPC_LOCK) and is skipped with a log message when they are missing.
+
+    :param priority: SCHED_FIFO priority (1-99). 0 leaves the scheduling policy alone.
+    :param cpus: Optional iterable of CPU indices to pin the thread to.
+    """
+
+    if cpus:
+        try:
+            os.sched_setaffinity(0, set(cpus))
+        except (AttributeError, OSError) as e:
+            logging.info('could not set CPU affinity to %s: %s', sorted(cpus), e)
+
+    if not priority:
+        return
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError) as e:
+        logging.info('could not switch to SCHED_FIFO priority %d: %s', priority, e)
+        return
+
+    # Only lock memory once we know we are privileged; an unprivileged MCL_FUTURE lock can make later allocations fail.
+    if platform.system() == 'Linux':
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlockall(_MCL_CURRENT | _MCL_FUTURE) != 0:
+            logging.info('could not lock memory: %s', os.strerror(ctypes.get_errno()))
+
+
+# CPUs the process may run on, captured at import before any thread is pinned.
+_PROCESS_CPUS = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+
+
+def reset_current_thread_scheduling():
+    """
+    Undoes ``make_current_thread_realtime`` inheritance for a thread spawned by a promoted one: back to the default
+    time-sharing policy and to every CPU the process may use. Best-effort, like the promotion itself.
+    """
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    except (AttributeError, OSError) as e:
+        logging.info('could not reset scheduling policy: %s', e)
+
+    if _PROCESS_CPUS:
+        try:
+            os.sched_setaffinity(0, _PROCESS_CPUS)
+        except OSError as e:
+            logging.info('could not reset CPU affinity: %s', e)
+
+
+class RingBuffer(object):
+    """
+    Single-producer/single-consumer ring of int16 samples. The PortAudio callback is the only writer and the detector
+    thread the only reader, so each index is owned by one side and the samples themselves need no lock; the only lock
+    the writer touches is the brief one inside ``Event.set`` used to wake the reader. The writer never waits on the
+    reader: if the reader falls more than ``max_backlog`` samples behind, it skips ahead to the newest audio and counts
+    what it skipped in ``dropped``.
+    """
+
+    def __init__(self, capacity, max_backlog=None):
+        """
+        Constructor.
+
+        :param capacity: Number of samples the ring can hold before the writer laps the reader.
+        :param max_backlog: Most unread samples kept before the oldest are dropped; defaults to ``capacity``.
+        """
+
+        self._buffer = numpy.zeros(capacity, dtype=numpy.int16)
+        self._capacity = capacity
+        self._max_backlog = capacity if max_backlog is None else max_backlog
+        self.dropped = 0
+        self._write_index = 0
+        self._read_index = 0
+        self._readable = Event()
+
+    def write(self, samples):
+        """
+        Copies samples into the ring. Safe to call from the PortAudio callback: no allocation, no blocking.
+
+        :param samples: 1-D int16 array.
+        """
+
+        count = len(samples)
+        start = self._write_index % self._capacity
+        end = start + count
+        if end <= self._capacity:
+            self._buffer[start:end] = samples
+        else:
+            split = self._capacity - start
+            self._buffer[start:] = samples[:split]
+            self._buffer[:end - self._capacity] = samples[split:]
+
+        # Publish the samples only once they have been copied in.
+        self._write_index += count
+        self._readable.set()
+
+    def readinto(self, out):
+        """
+        Blocks until ``len(out)`` samples are available and copies them into ``out``, so the reader can reuse one
+        preallocated frame instead of allocating a new array per read.
+
+        :param out: 1-D int16 array to fill.
+        """
+
+        count = len(out)
+        while self._write_index - self._read_index < count:
+            self._readable.wait()
+            self._readable.clear()
+
+        backlog = self._write_index - self._read_index
+        if backlog > self._max_backlog:
+            # Drop whole reads' worth of the oldest samples so the reader stays aligned on frame boundaries.
+            stale = -(-(backlog - self._max_backlog) // count) * count
+            self._read_index += stale
+            self.dropped += stale
+
+        start = self._read_index % self._capacity
+        end = start + count
+        if end <= self._capacity:
+            out[:] = self._buffer[start:end]
+        else:
+            split = self._capacity - start
+            out[:split] = self._buffer[start:]
+            out[split:] = self._buffer[:end - self._capacity]
+
+        self._read_index += count
+
 
 class HotwordServer(Thread):
     """
@@ -64,12 +419,26 @@ class HotwordServer(Thread):
     console. It optionally saves the recorded audio into a file for further review.
     """
 
+    # Pool that runs one Porcupine per keyword in parallel, shared by every HotwordServer so several servers do not
+    # oversubscribe the cores; it never has more workers than one fewer than the CPU count. Porcupine's ctypes calls
+    # release the GIL. Workers are spawned lazily from a promoted detector thread, so each one resets its policy and
+    # CPU affinity on start; otherwise they would all inherit that detector's SCHED_FIFO priority and pinning.
+    _detection_pool = None
+    _detection_pool_lock = Lock()
+
     def __init__(
             self,
             library_path,
             model_file_path,
             keyword_dir,
-            sensitivity=0.5):
+            keyword_names=('bumblebee',),
+            sensitivity=0.5,
+            realtime_priority=80,
+            cpu_affinity=None,
+            silence_gate=0,
+            input_device=None,
+            wasapi_exclusive=False,
+            period=None):
 
         """
         Constructor.
@@ -77,9 +446,19 @@ class HotwordServer(Thread):
         :param library_path: Absolute path to Porcupine's dynamic library.
         :param model_file_path: Absolute path to the model parameter file.
         :param keyword_dir: Dir to find keywords.
+        :param keyword_names: Names of the keywords to listen for, as found in ``keyword_dir``. Raises ValueError if
+        any is missing.
         :param sensitivity: Sensitivity parameter for  wake word. For more information refer to
         'include/pv_porcupine.h'. It uses the
         same sensitivity value for all keywords.
+        :param realtime_priority: SCHED_FIFO priority for the detection thread, 0 to keep the default scheduler.
+        :param cpu_affinity: Optional list of CPU indices to pin the detection thread to.
+        :param silence_gate: Skip Porcupine on frames whose energy is below this multiple of the noise floor. 0
+        disables the gate.
+        :param input_device: PortAudio input device (numeric ID or name substring); None for the default. On Linux an
+        ALSA ``hw:`` device avoids the resampling and mixing of ``default``.
+        :param wasapi_exclusive: Open the device in WASAPI exclusive mode (Windows, WASAPI devices only).
+        :param period: Hardware period of the input device in samples; the audio block size is aligned to it.
         """
 
         super(HotwordServer, self).__init__()
@@ -88,65 +467,179 @@ class HotwordServer(Thread):
         self._model_file_path = model_file_path
         self.keyword_dir = keyword_dir
         self._current_keyword = None
-
-        logging.info(f'{self._library_path}, {self._model_file_path}, {self.keyword_dir}')
-
-    @property
+        self._keyword_names = list(keyword_names)
+        self._sensitivity = sensitivity
+        self._realtime_priority = realtime_priority
+        self._cpu_affinity = cpu_affinity
+        self._silence_gate = silence_gate
+        self._input_device = input_device
+        self._wasapi_exclusive = wasapi_exclusive
+        self._period = period
+        self._notifications = queue.Queue()
+
+        # Resolve keyword files here so a bad name fails in the caller's thread, before any audio or Porcupine setup.
+        if not self._keyword_names:
+            raise ValueError('no keywords given')
+        missing = [name for name in self._keyword_names if name not in self.keywords]
+        if missing:
+            raise ValueError('unknown keyword(s) %s in %s; available: %s' % (
+                ', '.join(missing), self.keyword_dir, ', '.join(sorted(self.keywords))))
+        self._keyword_paths = [self.keywords[name] for name in self._keyword_names]
+
+        # Everything in a detection message but the timestamp is fixed for the run, so encode it once up front.
+        self._detection_prefixes = {
+            keyword_name: ('{"hotword":%s,"message":"detected","timestamp":"' % json.dumps(keyword_name)).encode()
+            for keyword_name in self._keyword_names}
+
+        logging.info('%s, %s, %s', self._library_path, self._model_file_path, self.keyword_dir)
+
+    @cached_property
     def keywords(self):
-        paths = set(glob.glob(os.path.join(self.keyword_dir, '*.ppn'), recursive=True)) - set(
-            glob.glob(os.path.join(self.keyword_dir, '*_compressed.ppn'), recursive=True))
+        """Map of keyword name to ``.ppn`` file in ``keyword_dir``. The directory is scanned once per instance."""
+        with os.scandir(self.keyword_dir) as entries:
+            paths = [entry.path for entry in entries
+                     if entry.name.endswith('.ppn') and not entry.name.endswith('_compressed.ppn')]
 
         result = dict(zip([os.path.basename(x).replace('.ppn', '').split('_')[0] for x in paths], paths))
-        logging.info('Keys: %r' % (repr([x for x in result.keys()])))
+        logging.info('Keys: %r', list(result))
         return result
 
-    def run(self, keyword_name='bumblebee', sensitivity=0.5):
+    @classmethod
+    def _get_detection_pool(cls):
+        with cls._detection_pool_lock:
+            if cls._detection_pool is None:
+                cls._detection_pool = ThreadPoolExecutor(
+                    max_workers=max(1, (os.cpu_count() or 1) - 1), thread_name_prefix='porcupine',
+                    initializer=reset_current_thread_scheduling)
+            return cls._detection_pool
+
+    def _send_notifications(self):
+        """
+        Drains ``(keyword, timestamp)`` detections queued by the detector loop and writes them to stdout, keeping JSON
+        encoding and blocking pipe writes off the detection thread.
+        """
+
+        while True:
+            keyword_name, timestamp = self._notifications.get()
+            detected_at = datetime.fromtimestamp(timestamp).isoformat()
+            content = self._detection_prefixes[keyword_name] + detected_at.encode() + _DETECTION_SUFFIX
+            sendMessage(frameMessage(content))
+            logging.info('[%s] detected keyword %s', detected_at, keyword_name)
+
+    def run(self):
         """
          Creates an input audio stream, initializes wake word detection (Porcupine) object, and monitors the audio
          stream for occurrences of the wake word(s). It prints the time of detection for each occurrence and index of
          wake word.
-         """
 
-        # print('- %s (sensitivity: %f)' % (keyword_name, sensitivity))
-
-        def sdcallback(indata, frames, time, status):
-            print('callback')
-            if status:
-                logging.info(status)
-            if (frames) >= porcupine.frame_length:
-                pcm = struct.unpack_from("h" * porcupine.frame_length, indata)
-                result = porcupine.process(pcm)
-                if result:
-                    encoded_message = encodeMessage(
-                        {'hotword': keyword_name, 'message': 'detected', 'timestamp': str(datetime.now().isoformat())})
-                    sendMessage(encoded_message)
-                    logging.info('[%s] detected keyword' % str(datetime.now()))
-                    # with sd.InputStream(samplerate=args.samplerate, device=args.device,
-                    #                     channels=args.channels, callback=sdcallback) as asr_stream:
-
-        porcupine = None
-        audio_stream = None
-        sample_rate = None
-        porcupine = Porcupine(
-            library_path=self._library_path,
-            model_file_path=self._model_file_path,
-            keyword_file_path=self.keywords.get('bumblebee'),
-            sensitivity=sensitivity)
-
-        # Make sure the file is opened before recording anything:
-        with sd.RawInputStream(channels=1, dtype='int16', samplerate=porcupine.sample_rate,
-                               blocksize=porcupine.frame_length, callback=sdcallback) as stream:
-            # print(' Pinned / Top repo Pinned / Top repositories sitories #' *  Pinned / Top repositories 80)
-            # print('press Ctrl+C to stop the recording')
-            # print('#' * 80)
-            while True:
-                1 == 1
+         Capture and detection run on separate threads: the low-latency PortAudio callback receives each block as an
+         int16 numpy array and only copies it into a ``RingBuffer``, and this thread copies ``frame_length`` samples at
+         a time from it into one preallocated frame and runs one Porcupine per keyword on it (in parallel on a shared
+         pool when there are several), so a slow detection or a GC pause never stalls the audio thread. When Numba is
+         installed each frame is DC-blocked in place before detection. Detections are only timestamped and queued
+         here; a daemon notifier thread encodes and writes them to stdout.
+         """
 
+        # Started before the promotion below so the notifier keeps the default scheduling policy.
+        Thread(target=self._send_notifications, daemon=True).start()
+
+        porcupines = []
+        # Detection futures of the current frame; drained before any Porcupine is deleted.
+        pending = []
+        try:
+            for keyword_path in self._keyword_paths:
+                porcupines.append(Porcupine(
+                    library_path=self._library_path,
+                    model_file_path=self._model_file_path,
+                    keyword_file_path=keyword_path,
+                    sensitivity=self._sensitivity))
+
+            frame_length = porcupines[0].frame_length
+            sample_rate = porcupines[0].sample_rate
+
+            # Compile (or load from the on-disk cache) the front-end now rather than on the first live frame. Without
+            # Numba, DC blocking would be a per-sample Python loop on every frame, so it is skipped.
+            if _HAVE_NUMBA:
+                dc_block(numpy.zeros(frame_length, dtype=numpy.int16), numpy.zeros(2), _DC_BLOCK_POLE)
+                frame_energy(numpy.zeros(frame_length, dtype=numpy.int16))
+
+            blocksize = aligned_blocksize(frame_length, self._period, frame_length * _BLOCK_FRAMES)
+            ring = RingBuffer(blocksize * _RING_BUFFER_BLOCKS, blocksize * _MAX_BACKLOG_BLOCKS)
+
+            # Bind the lookup once so the callback is nothing but a copy into the ring.
+            write = ring.write
+            status_count = 0
+            last_status = None
+
+            def sdcallback(indata, frames, time, status):
+                # Overflows are tolerated and only counted here; the detector loop logs them, keeping stderr I/O off
+                # the audio thread.
+                nonlocal status_count, last_status
+                if status:
+                    status_count += 1
+                    last_status = status
+                write(indata[:, 0])
+
+            extra_settings = sd.WasapiSettings(exclusive=True) if self._wasapi_exclusive else None
+
+            with sd.InputStream(device=self._input_device, channels=1, dtype='int16',
+                                samplerate=sample_rate, blocksize=blocksize,
+                                latency='low', extra_settings=extra_settings, callback=sdcallback):
+                readinto = ring.readinto
+                pcm = numpy.empty(frame_length, dtype=numpy.int16)
+                keyword_names = self._keyword_names
+                processes = [make_frame_processor(porcupine, pcm) for porcupine in porcupines]
+                if len(processes) == 1:
+                    process = processes[0]
+
+                    def detect():
+                        return (process(),)
+                else:
+                    submit = self._get_detection_pool().submit
+
+                    def detect():
+                        pending[:] = [submit(process) for process in processes]
+                        return [future.result() for future in pending]
+
+                notify = self._notifications.put_nowait
+                now = time.time
+                dc_state = numpy.zeros(2)
+                gate_is_open = SilenceGate(self._silence_gate).is_open if self._silence_gate else None
+                reported_dropped = 0
+                reported_status_count = 0
+                reported_at = now()
+
+                # Promote only now: Porcupine setup and JIT warm-up stay at normal priority, and PortAudio's callback
+                # thread has already been created, so it does not inherit this thread's policy or CPU pinning.
+                make_current_thread_realtime(self._realtime_priority, self._cpu_affinity)
+                while True:
+                    readinto(pcm)
+                    if ((ring.dropped != reported_dropped or status_count != reported_status_count)
+                            and now() - reported_at >= _AUDIO_REPORT_SECONDS):
+                        if ring.dropped != reported_dropped:
+                            logging.warning('detection fell behind, dropped %d samples', ring.dropped - reported_dropped)
+                            reported_dropped = ring.dropped
+                        if status_count != reported_status_count:
+                            logging.warning('audio input flagged %d blocks, last: %s',
+                                            status_count - reported_status_count, last_status)
+                            reported_status_count = status_count
+                        reported_at = now()
+                    if _HAVE_NUMBA:
+                        dc_block(pcm, dc_state, _DC_BLOCK_POLE)
+                    if gate_is_open is not None and not gate_is_open(pcm):
+                        continue
+                    for keyword_name, detected in zip(keyword_names, detect()):
+                        if detected:
+                            notify((keyword_name, now()))
+        finally:
+            # Running futures cannot be cancelled; wait for them so no worker is inside a Porcupine being deleted.
+            wait(pending)
             # delete Porcupine last to avoid segfault in callback.
-        if porcupine is not None:
-            porcupine.delete()
+            for porcupine in porcupines:
+                porcupine.delete()
 
 
+@lru_cache(maxsize=None)
 def get_library_path():
     system = platform.system()
     machine = platform.machine()
@@ -154,7 +647,7 @@ def get_library_path():
     if system == 'Darwin':
         return os.path.join(os.path.dirname(__file__), 'Porcupine/lib/mac/%s/libpv_porcupine.dylib' % machine)
     elif system == 'Linux':
-        if machine == 'x86_64' or machine == 'i386':
+        if machine in ('x86_64', 'i386'):
             return os.path.join(os.path.dirname(__file__), 'Porcupine/lib/linux/%s/libpv_porcupine.so' % machine)
         else:
             raise Exception(
@@ -184,7 +677,21 @@ if __name__ == '__main__':
         type=str,
         default=os.path.join(os.path.dirname(__file__), 'Porcupine/lib/common/porcupine_params.pv'))
 
-    parser.add_argument('--sensitivity', help='detection sensitivity [0, 1]', default=0.5)
+    parser.add_argument(
+        '--keywords', help='names of the keywords to listen for', type=str, nargs='+', default=['bumblebee'])
+
+    parser.add_argument('--sensitivity', help='detection sensitivity [0, 1]', type=float, default=0.5)
+
+    parser.add_argument(
+        '--realtime_priority', help='SCHED_FIFO priority of the detection thread, 0 to disable', type=int, default=80)
+
+    parser.add_argument(
+        '--cpu_affinity', help='CPU indices to pin the detection thread to', type=int, nargs='+')
+
+    parser.add_argument(
+        '--silence_gate',
+        help='skip detection on frames quieter than this multiple of the noise floor, 0 to disable',
+        type=float, default=0)
 
     parser.add_argument(
         '-l', '--list-devices', action='store_true',
@@ -192,6 +699,12 @@ if __name__ == '__main__':
     parser.add_argument(
         '-d', '--device', type=int_or_str,
         help='input device (numeric ID or substring)')
+    parser.add_argument(
+        '--period', type=int,
+        help='hardware period of the input device in samples (e.g. 256 or 1024); audio blocks are aligned to it')
+    parser.add_argument(
+        '--wasapi_exclusive', action='store_true',
+        help='open the input device in WASAPI exclusive mode (Windows only)')
     parser.add_argument(
         '-r', '--samplerate', type=int, help='sampling rate')
     parser.add_argument(
@@ -202,8 +715,19 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    if args.list_devices:
+        print(sd.query_devices())
+        parser.exit(0)
+
     HotwordServer(
         library_path=args.library_path,
         model_file_path=args.model_file_path,
         keyword_dir=args.keyword_dir,
-        sensitivity=args.sensitivity).run()
+        keyword_names=args.keywords,
+        sensitivity=args.sensitivity,
+        realtime_priority=args.realtime_priority,
+        cpu_affinity=args.cpu_affinity,
+        silence_gate=args.silence_gate,
+        input_device=args.device,
+        wasapi_exclusive=args.wasapi_exclusive,
+        period=args.period).run()